@@ -10,7 +10,7 @@ class Settings(BaseSettings):
     # Database - using SQLite by default (works everywhere, no setup needed)
     DATABASE_URL: str = "sqlite:///./disha_ai.db"
     
-    # Redis - not using yet but might need for caching later
+    # Redis - optional, persists the semantic response cache and shares typing state across workers
     REDIS_URL: Optional[str] = None
     
     # LLM config - add your API key to .env
@@ -23,6 +23,16 @@ class Settings(BaseSettings):
     MAX_RESPONSE_TOKENS: int = 1000
     MESSAGES_PER_PAGE: int = 50
     
+    # Tokenizer used for context accounting - huggingface is ~3x faster,
+    # tiktoken is exact for OpenAI models (handy for validating counts)
+    TOKENIZER_BACKEND: str = "huggingface"  # can be: huggingface or tiktoken
+    
+    # Semantic response cache - off by default, needs `pip install sentence-transformers`
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    SEMANTIC_CACHE_THRESHOLD: float = 0.9  # cosine similarity needed to reuse an answer
+    SEMANTIC_CACHE_TTL_SECONDS: int = 60 * 60  # cached answers don't see new memories, so keep them short-lived
+    
     # App settings
     ENVIRONMENT: str = "development"
     
@@ -1,6 +1,6 @@
 """Database configuration and session management."""
 # SQLAlchemy setup - pretty standard boilerplate
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import settings
@@ -14,6 +14,17 @@ engine = create_engine(
     max_overflow=20
 )
 
+
+# SQLite: WAL lets readers keep going while a write is in progress (default
+# rollback journal blocks them), and synchronous=NORMAL is safe under WAL
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
 # Session factory - creates new DB sessions
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -1,10 +1,75 @@
 """Initialize database script."""
 # Simple setup script - run this once to create tables and seed protocols
 from database import engine, Base, SessionLocal
-from models import User, Message, Memory, Protocol, TypingIndicator
+from models import User, Message, Memory, Protocol
 from services import ProtocolService
+from sqlalchemy import JSON, delete, func, inspect, select, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.schema import CreateIndex
+import re
 import sys
 
+# Indexes added after the first release - create_all() skips tables that already
+# exist, so older databases need these created explicitly
+ADDED_INDEXES = [
+    (Memory.__table__, "idx_user_importance"),
+    (Memory.__table__, "idx_user_category_key"),
+    (Message.__table__, "idx_user_id_desc"),
+]
+
+
+def convert_json_columns():
+    """Older Postgres databases store the JSON columns as json - switch them to jsonb"""
+    if engine.dialect.name != "postgresql":
+        return
+    
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            current_types = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if not isinstance(column.type.dialect_impl(engine.dialect), JSONB):
+                    continue
+                current = current_types.get(column.name)
+                if isinstance(current, JSON) and not isinstance(current, JSONB):
+                    conn.execute(text(
+                        f"ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE jsonb USING {column.name}::jsonb"
+                    ))
+
+
+def dedupe_memories():
+    """Older databases can hold several memories for the same user+category+key
+    (from before the upsert) - keep the newest one so the unique index can build"""
+    existing = {index["name"] for index in inspect(engine).get_indexes(Memory.__tablename__)}
+    if "idx_user_category_key" in existing:
+        return
+    
+    newest = (
+        select(func.max(Memory.id).label("id"))
+        .group_by(Memory.user_id, Memory.category, Memory.key)
+        .subquery()
+    )
+    with engine.begin() as conn:
+        result = conn.execute(delete(Memory).where(Memory.id.not_in(select(newest.c.id))))
+    if result.rowcount:
+        print(f"✓ Removed {result.rowcount} duplicate memories")
+
+
+def create_missing_indexes():
+    """Create indexes that existing databases don't have yet"""
+    for table, name in ADDED_INDEXES:
+        index = next(index for index in table.indexes if index.name == name)
+        if engine.dialect.name == "postgresql":
+            # CONCURRENTLY so a big table isn't write-locked while the index builds -
+            # it can't run inside a transaction, hence AUTOCOMMIT
+            ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+            ddl = re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text(ddl))
+        else:
+            index.create(bind=engine, checkfirst=True)
+
+
 def init_db():
     """Setup database - creates tables and adds default protocols"""
     try:
@@ -12,6 +77,17 @@ def init_db():
         Base.metadata.create_all(bind=engine)
         print("✓ Tables created successfully")
         
+        # Typing indicators moved to in-memory state - drop the old table if it's still around
+        # Same for the keyword GIN index - protocol matching never queried it
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS typing_indicators"))
+            conn.execute(text("DROP INDEX IF EXISTS idx_protocol_keywords_gin"))
+        
+        convert_json_columns()
+        dedupe_memories()
+        create_missing_indexes()
+        print("✓ Indexes up to date")
+        
         # Add the default medical protocols
         print("\nSeeding default protocols...")
         db = SessionLocal()
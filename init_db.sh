@@ -24,7 +24,7 @@ createdb $DB_NAME 2>/dev/null || echo "Database $DB_NAME already exists"
 echo "Creating database tables..."
 python3 << END
 from database import engine, Base
-from models import User, Message, Memory, Protocol, TypingIndicator
+from models import User, Message, Memory, Protocol
 
 print("Creating tables...")
 Base.metadata.create_all(bind=engine)
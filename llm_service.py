@@ -1,16 +1,242 @@
 """LLM service for handling AI interactions."""
 # Abstraction layer for different LLM providers - makes it easy to switch
 # Currently supporting OpenAI, Anthropic, and a demo mode for testing
-import openai
-import anthropic
-from typing import List, Dict, Optional, Tuple
+# Provider SDKs and tokenizers are imported lazily inside LLMService - they're
+# slow to import and only one provider is ever used per process
+from typing import TYPE_CHECKING, AsyncIterator, List, Dict, Optional, Tuple
 from config import settings
-import tiktoken
+import ahocorasick
+import jinja2
+import orjson
+import asyncio
+import functools
+import hashlib
 import logging
 import random
+import threading
+from collections import OrderedDict
+
+if TYPE_CHECKING:
+    import tokenizers
 
 logger = logging.getLogger(__name__)
 
+# Token counts keyed by content hash - system prompts and older history repeat
+# verbatim on every turn, so most lookups never reach the tokenizer
+_TOKEN_COUNT_CACHE_SIZE = 4096
+_token_count_cache: "OrderedDict[bytes, int]" = OrderedDict()
+_token_count_lock = threading.Lock()  # truncate_context runs in worker threads
+
+
+# HuggingFace ports of the OpenAI BPE vocabularies - same merges, faster Rust encoder
+_HF_TOKENIZER_REPOS = {"gpt-4": "Xenova/gpt-4"}
+
+
+class _HFTokenizer:
+    """Wraps a HuggingFace Tokenizer so it looks like a tiktoken Encoding
+    We only use the tokenizer for length accounting, never as model input"""
+    
+    def __init__(self, tokenizer: "tokenizers.Tokenizer"):
+        self._tokenizer = tokenizer
+    
+    def encode_ordinary(self, text: str) -> List[int]:
+        return self._tokenizer.encode(text, add_special_tokens=False).ids
+    
+    def encode_ordinary_batch(self, texts: List[str], num_threads: int = 4) -> List[List[int]]:
+        # HF parallelizes batches internally, num_threads is just for API parity
+        return [e.ids for e in self._tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+
+@functools.lru_cache(maxsize=None)
+def _get_tokenizer(model_name: str):
+    """Load the tokenizer once per model - building either backend is slow
+    TOKENIZER_BACKEND=tiktoken gives exact OpenAI counts if we ever need to validate"""
+    if settings.TOKENIZER_BACKEND == "huggingface":
+        try:
+            from tokenizers import Tokenizer
+            return _HFTokenizer(Tokenizer.from_pretrained(_HF_TOKENIZER_REPOS[model_name]))
+        except Exception as e:
+            logger.warning(f"Couldn't load HuggingFace tokenizer for {model_name}: {e}. Falling back to tiktoken.")
+    import tiktoken
+    return tiktoken.encoding_for_model(model_name)
+
+
+# Demo mode keyword categories in priority order - (keywords, canned response)
+_DEMO_CATEGORIES = (
+    (
+        ("fever", "temperature", "hot"),
+        "I'm sorry to hear you have a fever. For fever management:\n\n- If temp > 103°F or lasts > 3 days, see a doctor\n- Stay hydrated and rest\n- You can take paracetamol as directed\n- Monitor your temperature regularly\n\nHow long have you had this fever?",
+    ),
+    (
+        ("headache", "head pain", "migraine"),
+        "Headaches can be tough! Here's what might help:\n\n- Rest in a quiet, dark room\n- Stay hydrated - drink plenty of water\n- Apply a cold compress to your forehead\n- Avoid screens and bright lights\n\nIf it persists or gets worse, please see a doctor. Is there anything else bothering you?",
+    ),
+    (
+        ("stomach", "tummy", "abdomen"),
+        "For stomach discomfort, I'd recommend:\n\n- Eat light, bland foods like rice and bananas\n- Stay hydrated with water or ORS\n- Avoid spicy and oily foods\n- Rest for a bit\n\nIf pain is severe or persists, please consult a doctor. When did this start?",
+    ),
+    (
+        ("hi", "hello", "hey"),
+        "Hello! 👋 I'm Disha, your AI health coach. I'm here to help you with health questions and wellness guidance. How are you feeling today?",
+    ),
+    (
+        ("thank", "thanks"),
+        "You're welcome! I'm always here to help. Is there anything else you'd like to know about your health?",
+    ),
+)
+_DEMO_RESPONSES = tuple(response for _, response in _DEMO_CATEGORIES)
+
+_DEMO_GREETING = "Hi! I'm Disha, your AI health coach. 👋 How can I help you today?"
+_DEMO_QUESTION_RESPONSE = "That's a great question! While I'm running in demo mode right now, in the full version I'd provide personalized health guidance based on your profile and history. Would you like to tell me more about what's concerning you?"
+
+_DEMO_FALLBACK_RESPONSES = (
+    "I understand. Can you tell me more about what you're experiencing?",
+    "Thanks for sharing that with me. How long has this been going on?",
+    "I see. Are there any other symptoms you're noticing?",
+    "Got it. On a scale of 1-10, how would you rate your discomfort?",
+    "That's helpful to know. Have you experienced anything like this before?",
+)
+# Bound once so each demo reply skips the module + attribute lookups
+_pick = random.Random().choice
+
+
+
+def _build_demo_matcher() -> "ahocorasick.Automaton":
+    """Compile every demo keyword into one Aho-Corasick automaton (keyword -> category id)
+    so classifying a message is a single linear scan instead of one scan per category"""
+    automaton = ahocorasick.Automaton()
+    for category, (keywords, _) in enumerate(_DEMO_CATEGORIES):
+        for keyword in keywords:
+            automaton.add_word(keyword, category)
+    automaton.make_automaton()
+    return automaton
+
+
+_demo_matcher = _build_demo_matcher()
+
+
+_ONBOARDING_PROMPT = """You are Disha, India's first AI health coach. You're having your first conversation with a new user.
+
+Your goal is to:
+1. Welcome them warmly and introduce yourself naturally (don't sound robotic)
+2. Understand their health goals and current situation
+3. Gather basic information: age, any medical conditions, current medications, allergies
+4. Ask about their lifestyle: sleep, exercise, diet, stress levels
+5. Be empathetic and conversational - you're building a relationship, not conducting an interrogation
+
+Important:
+- Ask ONE question at a time, keep it conversational
+- Show genuine interest in their responses
+- Be supportive and non-judgmental
+- Remember everything they tell you for future conversations
+- Sound like a caring friend, not a clinical chatbot
+- Use simple language, avoid medical jargon unless necessary
+
+Keep your responses concise and natural. Think WhatsApp chat, not medical consultation."""
+
+# Regular conversation prompt - static text goes first and per-user/per-message sections last,
+# so the prompt prefix stays identical across requests and OpenAI's prompt cache can reuse it
+# The static part is also tokenized once per process instead of on every turn
+_STATIC_SYSTEM_PROMPT = """You are Disha, India's first AI health coach. You communicate like a caring friend on WhatsApp.
+
+Your personality:
+- Warm, empathetic, and supportive
+- Use simple language, avoid medical jargon
+- Keep responses concise (2-3 sentences usually)
+- Be conversational, not robotic or clinical
+- Show you remember past conversations
+- Ask follow-up questions when appropriate
+
+
+Important Guidelines:
+- For medical emergencies, always advise immediate medical attention
+- You're a health coach, not a doctor - don't diagnose or prescribe
+- Use the protocols below when relevant
+- Be encouraging about healthy habits
+- Keep responses short and WhatsApp-friendly
+"""
+
+# Dynamic tail - profile/memories/protocols sections only show up when we have them
+_SYSTEM_PROMPT_SOURCE = """{% if profile %}
+
+
+User Profile:
+{% if profile.full_name %}
+- Name: {{ profile.full_name }}
+{% endif %}
+{% if profile.age %}
+- Age: {{ profile.age }}
+{% endif %}
+{% if profile.gender %}
+- Gender: {{ profile.gender }}
+{% endif %}
+{% if profile.medical_conditions %}
+- Medical Conditions: {{ profile.medical_conditions | join(", ") }}
+{% endif %}
+{% if profile.medications %}
+- Medications: {{ profile.medications | join(", ") }}
+{% endif %}
+{% if profile.allergies %}
+- Allergies: {{ profile.allergies | join(", ") }}
+{% endif %}
+{% endif %}
+{% if memories %}
+
+
+Relevant Context from Past Conversations:
+{% for memory in memories %}
+- {{ memory.key }}: {{ memory.value }}
+{% endfor %}
+{% endif %}
+{% if protocols %}
+
+
+Relevant Medical Protocols:
+{% for protocol in protocols %}
+
+{{ protocol.name }}:
+{{ protocol.response_template }}
+{% endfor %}
+{% endif %}"""
+
+# Compiled once at import; auto_reload off since the source never changes at runtime
+_prompt_env = jinja2.Environment(
+    loader=jinja2.BaseLoader(),
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True
+)
+_SYSTEM_PROMPT_TEMPLATE = _prompt_env.from_string(_SYSTEM_PROMPT_SOURCE)
+
+
+# Anthropic has no JSON mode - forcing this tool gets us schema-shaped memories instead
+_MEMORY_TOOL = {
+    "name": "save_memories",
+    "description": "Save key facts about the user worth remembering for future conversations",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "memories": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "category": {
+                            "type": "string",
+                            "enum": ["health_goal", "preference", "medical_history", "lifestyle", "concern"]
+                        },
+                        "key": {"type": "string"},
+                        "value": {"type": "string"},
+                        "importance": {"type": "integer", "minimum": 1, "maximum": 5}
+                    },
+                    "required": ["category", "key", "value", "importance"]
+                }
+            }
+        },
+        "required": ["memories"]
+    }
+}
+
 
 class LLMService:
     """Service for interacting with LLM APIs."""
@@ -25,36 +251,87 @@ class LLMService:
         if self.provider == "openai":
             if not settings.OPENAI_API_KEY:
                 raise ValueError("OPENAI_API_KEY not set in .env file")
-            self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
+            import openai
+            self.client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
             self.model = "gpt-4o-mini"
-            self.tokenizer = tiktoken.encoding_for_model("gpt-4")
+            self.tokenizer = _get_tokenizer("gpt-4")
         elif self.provider == "anthropic":
             if not settings.ANTHROPIC_API_KEY:
                 raise ValueError("ANTHROPIC_API_KEY not set in .env file")
-            self.client = anthropic.Anthropic(
+            import anthropic
+            self.client = anthropic.AsyncAnthropic(
                 api_key=settings.ANTHROPIC_API_KEY,
                 max_retries=2
             )
             self.model = "claude-3-5-sonnet-20241022"
             # Anthropic uses similar tokenization
-            self.tokenizer = tiktoken.encoding_for_model("gpt-4")
+            self.tokenizer = _get_tokenizer("gpt-4")
         elif self.provider == "demo":
             # Demo mode - no API calls
             logger.warning("Running in DEMO mode - using mock responses")
             self.client = None
             self.model = "demo-mock"
-            self.tokenizer = tiktoken.encoding_for_model("gpt-4")
+            self.tokenizer = _get_tokenizer("gpt-4")
         else:
             raise ValueError(f"Unsupported LLM provider: {self.provider}. Use 'openai', 'anthropic', or 'demo'")
+        
+        # Optional semantic cache - answers repeat questions without calling the LLM
+        self.semantic_cache = None
+        if settings.SEMANTIC_CACHE_ENABLED and self.provider != "demo":
+            try:
+                from semantic_cache import SemanticCache
+                self.semantic_cache = SemanticCache(
+                    model_name=settings.SEMANTIC_CACHE_MODEL,
+                    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+                    ttl_seconds=settings.SEMANTIC_CACHE_TTL_SECONDS,
+                    redis_url=settings.REDIS_URL
+                )
+            except ImportError as e:
+                logger.warning(f"Semantic cache disabled - missing dependency: {e}")
+        
+        # Personality + guidelines never change - count them once, not on every turn
+        self.static_prompt_tokens = self.count_tokens(_STATIC_SYSTEM_PROMPT)
     
     def count_tokens(self, text: str) -> int:
-        """Count tokens using tiktoken - need this to avoid hitting context limits"""
+        """Count tokens - need this to avoid hitting context limits"""
+        return self.count_tokens_batch([text])[0]
+    
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Count tokens for several texts at once
+        Cache misses go through one encode_ordinary_batch call instead of N encode calls"""
+        hashes = [hashlib.blake2b(text.encode(), digest_size=16).digest() for text in texts]
+        with _token_count_lock:
+            counts = [_token_count_cache.get(text_hash) for text_hash in hashes]
+            for text_hash, count in zip(hashes, counts):
+                if count is not None:
+                    _token_count_cache.move_to_end(text_hash)
+        
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if not missing:
+            return counts
+        
         try:
-            return len(self.tokenizer.encode(text))
+            if len(missing) == 1:
+                # Batch API spins up a thread pool - not worth it for a single text
+                encoded = [self.tokenizer.encode_ordinary(texts[missing[0]])]
+            else:
+                encoded = self.tokenizer.encode_ordinary_batch(
+                    [texts[i] for i in missing], num_threads=4
+                )
         except Exception as e:
             logger.warning(f"Error counting tokens: {e}. Using estimate.")
             # Rough estimate: 1 token ≈ 4 characters
-            return len(text) // 4
+            for i in missing:
+                counts[i] = len(texts[i]) // 4
+            return counts
+        
+        with _token_count_lock:
+            for i, tokens in zip(missing, encoded):
+                counts[i] = len(tokens)
+                _token_count_cache[hashes[i]] = counts[i]
+            while len(_token_count_cache) > _TOKEN_COUNT_CACHE_SIZE:
+                _token_count_cache.popitem(last=False)  # evict least recently used
+        return counts
     
     def truncate_context(
         self,
@@ -65,11 +342,29 @@ class LLMService:
         """
         Truncate message history to fit within token limits.
         Keeps system prompt and most recent messages.
+        Messages loaded from the DB carry a precomputed "token_count" so we
+        don't re-tokenize the whole history on every turn.
         """
         if max_tokens is None:
             max_tokens = self.max_context_tokens
         
-        system_tokens = self.count_tokens(system_prompt)
+        # Regular prompts start with the static part we've already counted - only the
+        # dynamic tail needs tokenizing (may be off by a token at the seam, fine for a budget)
+        prompt_tokens = 0
+        if system_prompt.startswith(_STATIC_SYSTEM_PROMPT):
+            prompt_tokens = self.static_prompt_tokens
+            system_prompt = system_prompt[len(_STATIC_SYSTEM_PROMPT):]
+        
+        # Tokenize the system prompt and any uncounted messages in one batch
+        uncounted = [i for i, message in enumerate(messages) if not message.get("token_count")]
+        counts = self.count_tokens_batch(
+            [system_prompt] + [messages[i]["content"] for i in uncounted]
+        )
+        system_tokens = prompt_tokens + counts[0]
+        message_tokens = [message.get("token_count") for message in messages]
+        for i, count in zip(uncounted, counts[1:]):
+            message_tokens[i] = count
+        
         available_tokens = max_tokens - system_tokens - self.max_response_tokens
         
         # Always keep the most recent message
@@ -77,10 +372,10 @@ class LLMService:
         current_tokens = 0
         
         # Iterate from most recent to oldest
-        for message in reversed(messages):
-            msg_tokens = self.count_tokens(message["content"])
+        for message, msg_tokens in zip(reversed(messages), reversed(message_tokens)):
             if current_tokens + msg_tokens <= available_tokens:
-                truncated.insert(0, message)
+                # Providers only accept role/content - drop our bookkeeping fields
+                truncated.insert(0, {"role": message["role"], "content": message["content"]})
                 current_tokens += msg_tokens
             else:
                 # Can't fit more messages
@@ -88,11 +383,11 @@ class LLMService:
         
         # If we couldn't fit any messages, include at least the last one (truncated)
         if not truncated and messages:
-            last_msg = messages[-1].copy()
+            last_msg = {"role": messages[-1]["role"], "content": messages[-1]["content"]}
             max_content_tokens = available_tokens - 100  # Safety margin
             
             # Truncate content if needed
-            content_tokens = self.count_tokens(last_msg["content"])
+            content_tokens = message_tokens[-1]
             if content_tokens > max_content_tokens:
                 # Rough truncation by character count
                 chars_per_token = len(last_msg["content"]) / content_tokens
@@ -113,100 +408,83 @@ class LLMService:
         """Create a comprehensive system prompt."""
         
         if is_onboarding:
-            return """You are Disha, India's first AI health coach. You're having your first conversation with a new user.
-
-Your goal is to:
-1. Welcome them warmly and introduce yourself naturally (don't sound robotic)
-2. Understand their health goals and current situation
-3. Gather basic information: age, any medical conditions, current medications, allergies
-4. Ask about their lifestyle: sleep, exercise, diet, stress levels
-5. Be empathetic and conversational - you're building a relationship, not conducting an interrogation
-
-Important:
-- Ask ONE question at a time, keep it conversational
-- Show genuine interest in their responses
-- Be supportive and non-judgmental
-- Remember everything they tell you for future conversations
-- Sound like a caring friend, not a clinical chatbot
-- Use simple language, avoid medical jargon unless necessary
-
-Keep your responses concise and natural. Think WhatsApp chat, not medical consultation."""
-        
-        # Regular conversation prompt
-        prompt_parts = [
-            "You are Disha, India's first AI health coach. You communicate like a caring friend on WhatsApp.",
-            "\nYour personality:",
-            "- Warm, empathetic, and supportive",
-            "- Use simple language, avoid medical jargon",
-            "- Keep responses concise (2-3 sentences usually)",
-            "- Be conversational, not robotic or clinical",
-            "- Show you remember past conversations",
-            "- Ask follow-up questions when appropriate"
-        ]
-        
-        # Add user profile if available
-        if user_profile:
-            prompt_parts.append("\n\nUser Profile:")
-            if user_profile.get("full_name"):
-                prompt_parts.append(f"- Name: {user_profile['full_name']}")
-            if user_profile.get("age"):
-                prompt_parts.append(f"- Age: {user_profile['age']}")
-            if user_profile.get("gender"):
-                prompt_parts.append(f"- Gender: {user_profile['gender']}")
-            if user_profile.get("medical_conditions"):
-                prompt_parts.append(f"- Medical Conditions: {', '.join(user_profile['medical_conditions'])}")
-            if user_profile.get("medications"):
-                prompt_parts.append(f"- Medications: {', '.join(user_profile['medications'])}")
-            if user_profile.get("allergies"):
-                prompt_parts.append(f"- Allergies: {', '.join(user_profile['allergies'])}")
-        
-        # Add relevant memories
-        if memories:
-            prompt_parts.append("\n\nRelevant Context from Past Conversations:")
-            for memory in memories[:5]:  # Top 5 only - don't want to bloat the prompt
-                prompt_parts.append(f"- {memory['key']}: {memory['value']}")
+            return _ONBOARDING_PROMPT
         
-        # Add relevant protocols
-        if protocols:
-            prompt_parts.append("\n\nRelevant Medical Protocols:")
-            for protocol in protocols[:3]:  # Max 3 protocols to keep context manageable
-                prompt_parts.append(f"\n{protocol['name']}:")
-                prompt_parts.append(protocol['response_template'])
+        return _STATIC_SYSTEM_PROMPT + self._render_dynamic(user_profile, memories, protocols)
+    
+    @staticmethod
+    def _render_dynamic(user_profile: Dict, memories: List[Dict], protocols: List[Dict]) -> str:
+        """Just the per-user part of the system prompt"""
+        # Template is compiled once at import - this is just a render
+        return _SYSTEM_PROMPT_TEMPLATE.render(
+            profile=user_profile,
+            memories=memories[:5],  # Top 5 only - don't want to bloat the prompt
+            protocols=protocols[:3]  # Max 3 protocols to keep context manageable
+        )
+    
+    async def _prepare_call(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: str,
+        metadata: Dict
+    ) -> List[Dict[str, str]]:
+        """Truncate history to the token budget and fill in the basic call metadata"""
+        # Make sure we're not over token limit - tokenizing is CPU work, so do it
+        # in a thread (both tokenizers release the GIL) and keep the event loop free
+        truncated_messages = await asyncio.to_thread(self.truncate_context, messages, system_prompt)
         
-        prompt_parts.append("\n\nImportant Guidelines:")
-        prompt_parts.append("- For medical emergencies, always advise immediate medical attention")
-        prompt_parts.append("- You're a health coach, not a doctor - don't diagnose or prescribe")
-        prompt_parts.append("- Use the protocols above when relevant")
-        prompt_parts.append("- Be encouraging about healthy habits")
-        prompt_parts.append("- Keep responses short and WhatsApp-friendly")
+        metadata.update({
+            "provider": self.provider,
+            "model": self.model,
+            "messages_used": len(truncated_messages),
+            "total_messages": len(messages)
+        })
+        return truncated_messages
+    
+    async def _check_semantic_cache(
+        self,
+        truncated_messages: List[Dict[str, str]],
+        cache_scope: Optional[str]
+    ) -> Tuple[Optional[Tuple[bytes, object]], Optional[str]]:
+        """Returns ((cache key, question embedding), cached response) - both None when
+        the cache is off or doesn't apply to this call"""
+        # No scope means the caller can't say whose answer this is - never cache then
+        if self.semantic_cache is None or not truncated_messages or cache_scope is None:
+            return None, None
         
-        return "\n".join(prompt_parts)
+        cache_key = self.semantic_cache.context_key(cache_scope, _STATIC_SYSTEM_PROMPT)
+        vector = await asyncio.to_thread(self.semantic_cache.embed, truncated_messages[-1]["content"])
+        cached = await asyncio.to_thread(self.semantic_cache.lookup, cache_key, vector)
+        return (cache_key, vector), cached
     
     async def generate_response(
         self,
         messages: List[Dict[str, str]],
-        system_prompt: str
+        system_prompt: str,
+        cache_scope: Optional[str] = None
     ) -> Tuple[str, Dict]:
         """Call the LLM API and get response
         Returns both the text and some metadata about the call
+        cache_scope: whose semantic cache bucket this call may use (one user) - None skips it
         """
         try:
-            # Make sure we're not over token limit
-            truncated_messages = self.truncate_context(messages, system_prompt)
-            
-            metadata = {
-                "provider": self.provider,
-                "model": self.model,
-                "messages_used": len(truncated_messages),
-                "total_messages": len(messages)
-            }
+            metadata = {}
+            truncated_messages = await self._prepare_call(messages, system_prompt, metadata)
             
             # Demo mode
             if self.provider == "demo":
                 return self._generate_demo_response(truncated_messages, metadata)
             
+            cache_entry, cached = await self._check_semantic_cache(
+                truncated_messages, cache_scope
+            )
+            if cached is not None:
+                metadata["cache_hit"] = True
+                metadata["tokens_used"] = 0
+                return cached, metadata
+            
             if self.provider == "openai":
-                response = self.client.chat.completions.create(
+                response = await self.client.chat.completions.create(
                     model=self.model,
                     messages=[
                         {"role": "system", "content": system_prompt},
@@ -218,10 +496,13 @@ Keep your responses concise and natural. Think WhatsApp chat, not medical consul
                 
                 content = response.choices[0].message.content
                 metadata["tokens_used"] = response.usage.total_tokens
+                # Prompt tokens served from OpenAI's prefix cache (billed at half price)
+                details = response.usage.prompt_tokens_details
+                metadata["cached_tokens"] = (details.cached_tokens or 0) if details else 0
                 
             elif self.provider == "anthropic":
                 # Anthropic is different - system prompt is separate param, not in messages
-                response = self.client.messages.create(
+                response = await self.client.messages.create(
                     model=self.model,
                     max_tokens=self.max_response_tokens,
                     system=system_prompt,
@@ -235,49 +516,109 @@ Keep your responses concise and natural. Think WhatsApp chat, not medical consul
             else:
                 raise ValueError(f"Unsupported provider: {self.provider}")
             
+            if cache_entry is not None:
+                await asyncio.to_thread(self.semantic_cache.store, *cache_entry, content)
+            
             return content, metadata
             
         except Exception as e:
             logger.error(f"Error generating response: {e}")
             raise
     
+    async def stream_response(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: str,
+        metadata: Dict,
+        cache_scope: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Same as generate_response but yields the reply text as it's generated
+        `metadata` is filled in place and is complete once the stream is exhausted"""
+        try:
+            truncated_messages = await self._prepare_call(messages, system_prompt, metadata)
+            metadata["streamed"] = True
+            
+            # Demo mode - nothing to stream, send the whole reply at once
+            if self.provider == "demo":
+                content, _ = self._generate_demo_response(truncated_messages, metadata)
+                yield content
+                return
+            
+            cache_entry, cached = await self._check_semantic_cache(
+                truncated_messages, cache_scope
+            )
+            if cached is not None:
+                metadata["cache_hit"] = True
+                metadata["tokens_used"] = 0
+                yield cached
+                return
+            
+            chunks = []
+            if self.provider == "openai":
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        *truncated_messages
+                    ],
+                    max_tokens=self.max_response_tokens,
+                    temperature=0.7,
+                    stream=True,
+                    stream_options={"include_usage": True}  # usage arrives in the last chunk
+                )
+                async for chunk in stream:
+                    if chunk.usage:
+                        metadata["tokens_used"] = chunk.usage.total_tokens
+                        details = chunk.usage.prompt_tokens_details
+                        metadata["cached_tokens"] = (details.cached_tokens or 0) if details else 0
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        chunks.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            
+            elif self.provider == "anthropic":
+                async with self.client.messages.stream(
+                    model=self.model,
+                    max_tokens=self.max_response_tokens,
+                    system=system_prompt,
+                    messages=truncated_messages,
+                    temperature=0.7
+                ) as stream:
+                    async for text in stream.text_stream:
+                        chunks.append(text)
+                        yield text
+                    final_message = await stream.get_final_message()
+                    metadata["tokens_used"] = final_message.usage.input_tokens + final_message.usage.output_tokens
+            
+            else:
+                raise ValueError(f"Unsupported provider: {self.provider}")
+            
+            if cache_entry is not None:
+                await asyncio.to_thread(self.semantic_cache.store, *cache_entry, "".join(chunks))
+            
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            raise
+    
     def _generate_demo_response(self, messages: List[Dict[str, str]], metadata: Dict) -> Tuple[str, Dict]:
         """Demo mode - pattern matching for testing without burning API credits
-        Just matching keywords, nothing fancy"""
+        Just matching keywords against a precompiled automaton, nothing fancy"""
         if not messages:
-            response = "Hi! I'm Disha, your AI health coach. 👋 How can I help you today?"
+            response = _DEMO_GREETING
         else:
             last_message = messages[-1]["content"].lower()
             
-            # Simple pattern matching - could make this smarter
-            # maybe use regex or even a small classifier model?
-            if any(word in last_message for word in ["fever", "temperature", "hot"]):
-                response = "I'm sorry to hear you have a fever. For fever management:\n\n- If temp > 103°F or lasts > 3 days, see a doctor\n- Stay hydrated and rest\n- You can take paracetamol as directed\n- Monitor your temperature regularly\n\nHow long have you had this fever?"
-            
-            elif any(word in last_message for word in ["headache", "head pain", "migraine"]):
-                response = "Headaches can be tough! Here's what might help:\n\n- Rest in a quiet, dark room\n- Stay hydrated - drink plenty of water\n- Apply a cold compress to your forehead\n- Avoid screens and bright lights\n\nIf it persists or gets worse, please see a doctor. Is there anything else bothering you?"
-            
-            elif any(word in last_message for word in ["stomach", "tummy", "abdomen"]):
-                response = "For stomach discomfort, I'd recommend:\n\n- Eat light, bland foods like rice and bananas\n- Stay hydrated with water or ORS\n- Avoid spicy and oily foods\n- Rest for a bit\n\nIf pain is severe or persists, please consult a doctor. When did this start?"
-            
-            elif any(word in last_message for word in ["hi", "hello", "hey"]):
-                response = "Hello! 👋 I'm Disha, your AI health coach. I'm here to help you with health questions and wellness guidance. How are you feeling today?"
+            # One pass over the message finds every keyword; lowest category id
+            # wins so the priority order (fever before greetings etc.) is kept
+            category = min((cat for _, cat in _demo_matcher.iter(last_message)), default=None)
             
-            elif any(word in last_message for word in ["thank", "thanks"]):
-                response = "You're welcome! I'm always here to help. Is there anything else you'd like to know about your health?"
+            if category is not None:
+                response = _DEMO_RESPONSES[category]
             
             elif "?" in last_message:
-                response = "That's a great question! While I'm running in demo mode right now, in the full version I'd provide personalized health guidance based on your profile and history. Would you like to tell me more about what's concerning you?"
+                response = _DEMO_QUESTION_RESPONSE
             
             else:
-                responses = [
-                    "I understand. Can you tell me more about what you're experiencing?",
-                    "Thanks for sharing that with me. How long has this been going on?",
-                    "I see. Are there any other symptoms you're noticing?",
-                    "Got it. On a scale of 1-10, how would you rate your discomfort?",
-                    "That's helpful to know. Have you experienced anything like this before?",
-                ]
-                response = random.choice(responses)
+                response = _pick(_DEMO_FALLBACK_RESPONSES)
         
         metadata["tokens_used"] = len(response) // 4  # Rough estimate
         metadata["demo_mode"] = True
@@ -289,49 +630,61 @@ Keep your responses concise and natural. Think WhatsApp chat, not medical consul
         This is kinda meta - using AI to decide what's worth remembering
         Probably could optimize this prompt more but it works decent enough
         """
+        # Demo mode has no client to ask
+        if self.provider == "demo":
+            return []
+        
         try:
             prompt = f"""Analyze this conversation and extract key information that should be remembered about the user.
-Return a JSON list of memories in this format:
-[{{"category": "health_goal", "key": "primary_goal", "value": "description", "importance": 1-5}}]
+Return a JSON object with key "memories" that is a list of memories in this format:
+{{"memories": [{{"category": "health_goal", "key": "primary_goal", "value": "description", "importance": 1-5}}]}}
 
 Categories: health_goal, preference, medical_history, lifestyle, concern
 
 Conversation:
 {conversation}
 
-Extract only factual, important information. Return empty list if nothing significant."""
+Extract only factual, important information. Return an empty list if nothing significant."""
 
+            # Both providers are forced into structured output, so no more
+            # markdown fences or chatty preambles breaking the parse
             if self.provider == "openai":
-                response = self.client.chat.completions.create(
+                response = await self.client.chat.completions.create(
                     model=self.model,
                     messages=[{"role": "user", "content": prompt}],
                     max_tokens=500,
-                    temperature=0.3
+                    temperature=0.3,
+                    response_format={"type": "json_object"}
                 )
-                result = response.choices[0].message.content
+                try:
+                    memories = orjson.loads(response.choices[0].message.content).get("memories")
+                except (orjson.JSONDecodeError, AttributeError):
+                    logger.warning("Failed to parse memories JSON")
+                    return []
             else:
-                response = self.client.messages.create(
+                response = await self.client.messages.create(
                     model=self.model,
                     max_tokens=500,
                     messages=[{"role": "user", "content": prompt}],
-                    temperature=0.3
+                    temperature=0.3,
+                    tools=[_MEMORY_TOOL],
+                    tool_choice={"type": "tool", "name": _MEMORY_TOOL["name"]}
+                )
+                # Tool input comes back already parsed
+                memories = next(
+                    (block.input.get("memories") for block in response.content if block.type == "tool_use"),
+                    None
                 )
-                result = response.content[0].text
             
-            # Parse JSON response
-            import json
-            try:
-                memories = json.loads(result)
-                return memories if isinstance(memories, list) else []
-            except json.JSONDecodeError:
-                # Sometimes LLM returns non-JSON or adds extra text
-                logger.warning("Failed to parse memories JSON")
-                return []
+            return memories if isinstance(memories, list) else []
                 
         except Exception as e:
             logger.error(f"Error extracting memories: {e}")
             return []
 
 
-# Singleton instance
-llm_service = LLMService()
+@functools.lru_cache(maxsize=1)
+def get_llm_service() -> LLMService:
+    """Shared LLMService instance, built on first use instead of at import
+    The app builds it in its startup hook (main.lifespan), so requests never pay for it"""
+    return LLMService()
@@ -1,18 +1,26 @@
 """Main FastAPI application."""
 # Had to use FastAPI over Flask - better async support and auto API docs
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, StreamingResponse
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-from typing import Optional
+from pydantic import BaseModel
+from typing import Optional, Tuple
+import asyncio
+import contextlib
+import functools
+import hashlib
 import logging
+import orjson
+import time
 from datetime import datetime
 
-from database import engine, get_db, Base
+from database import engine, get_db
 from models import User
 from schemas import (
-    UserCreate, UserResponse, MessageCreate, MessageResponse,
+    UserCreate, UserResponse, MessageCreate,
     ChatRequest, ChatResponse, MessageListResponse, OnboardingData,
     TypingUpdate, TypingStatus, HealthCheck, MemoryCreate, MemoryResponse,
     ProtocolCreate, ProtocolResponse
@@ -21,6 +29,7 @@ from services import (
     UserService, MessageService, ChatService, TypingService,
     MemoryService, ProtocolService
 )
+from llm_service import get_llm_service
 from config import settings
 
 # Configure logging
@@ -30,14 +39,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Tables are created by init_db.py (runs in the build step) - not on every import
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the LLM service (client, tokenizer download, prompt token count) before
+    serving - in a thread so it doesn't block the loop, and a bad config or missing
+    tokenizer fails startup instead of every chat request"""
+    await asyncio.to_thread(get_llm_service)
+    yield
+
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Disha AI Health Coach",
     description="AI-powered health coaching chat API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse  # orjson encodes lists/datetimes way faster than stdlib json
 )
 
 # CORS - allowing everything for now, TODO: lock this down before prod
@@ -50,37 +70,84 @@ app.add_middleware(
 )
 
 
+# Probes can fire every couple of seconds - reuse the last DB ping for a bit
+HEALTH_CHECK_TTL = 5  # seconds
+_db_health = (float("-inf"), "unknown")  # (checked_at, status)
+
+
+# Endpoints that only touch the DB are plain `def` - the DB driver is blocking,
+# so FastAPI runs them in its threadpool instead of stalling the event loop
+
 # Dependency to get current user
 # TODO: add proper auth later - using query param for now to keep it simple
-async def get_current_user(
+def get_current_user(
     username: str = "default_user",
     db: Session = Depends(get_db)
 ) -> User:
-    """Get or create current user - lazy creation pattern"""
-    return UserService.get_or_create_user(db, username)
+    """Get or create current user - lazy creation pattern, cached for a minute"""
+    return UserService.get_cached_user(db, username)
 
 
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    """Serve the frontend."""
+def _model_response(model: BaseModel, status_code: int = status.HTTP_200_OK) -> Response:
+    """Send an already-built response model as-is - pydantic-core writes the JSON bytes
+    directly, no model_dump() dict round-trip and no response_model re-validation"""
+    return Response(
+        content=model.model_dump_json(),
+        status_code=status_code,
+        media_type="application/json"
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _load_frontend() -> Optional[Tuple[bytes, str]]:
+    """Read index.html once (it only changes on deploy) and compute its ETag"""
     try:
-        with open("static/index.html", "r") as f:
-            return f.read()
+        with open("static/index.html", "rb") as f:
+            content = f.read()
     except FileNotFoundError:
-        return "<h1>Disha AI Health Coach</h1><p>Frontend not found. API is running at /docs</p>"
+        return None
+    return content, f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
 
 
-@app.get("/health", response_model=HealthCheck)
-async def health_check(db: Session = Depends(get_db)):
-    """Health check endpoint - useful for monitoring/deployments"""
+@app.get("/", response_class=HTMLResponse)
+async def root(request: Request):
+    """Serve the frontend."""
+    frontend = _load_frontend()
+    if frontend is None:
+        return "<h1>Disha AI Health Coach</h1><p>Frontend not found. API is running at /docs</p>"
+    
+    content, etag = frontend
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=300"}
+    # Browser already has this version - skip the body
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return HTMLResponse(content=content, headers=headers)
+
+
+def _check_database() -> str:
+    """Ping the DB on a pooled connection - no ORM session needed for this"""
+    global _db_health
+    checked_at, db_status = _db_health
+    if time.monotonic() - checked_at < HEALTH_CHECK_TTL:
+        return db_status
+    
     try:
-        # Quick DB ping to make sure connection is alive
-        db.execute("SELECT 1")
+        with engine.connect() as conn:
+            conn.scalar(text("SELECT 1"))
         db_status = "healthy"
     except Exception as e:
         logger.error(f"Database health check failed: {e}")
         db_status = "unhealthy"
     
+    _db_health = (time.monotonic(), db_status)
+    return db_status
+
+
+@app.get("/health", response_model=HealthCheck)
+def health_check():
+    """Health check endpoint - useful for monitoring/deployments"""
+    db_status = _check_database()
+    
     return HealthCheck(
         status="healthy" if db_status == "healthy" else "unhealthy",
         timestamp=datetime.utcnow(),
@@ -91,7 +158,7 @@ async def health_check(db: Session = Depends(get_db)):
 
 # User endpoints
 @app.post("/api/users", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def create_user(
+def create_user(
     user_data: UserCreate,
     db: Session = Depends(get_db)
 ):
@@ -102,30 +169,31 @@ async def create_user(
             user.full_name = user_data.full_name
             db.commit()
             db.refresh(user)
-        return user
+            UserService.invalidate_cached_user(user.username)
+        return _model_response(UserService.to_response(user), status_code=status.HTTP_201_CREATED)
     except Exception as e:
         logger.error(f"Error creating user: {e}")
         raise HTTPException(status_code=500, detail="Error creating user")
 
 
 @app.get("/api/users/me", response_model=UserResponse)
-async def get_current_user_info(
+def get_current_user_info(
     current_user: User = Depends(get_current_user)
 ):
     """Get current user information."""
-    return current_user
+    return _model_response(UserService.to_response(current_user))
 
 
 @app.put("/api/users/me/onboarding", response_model=UserResponse)
-async def complete_onboarding(
+def complete_onboarding(
     onboarding_data: OnboardingData,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Complete user onboarding."""
     try:
-        user = UserService.update_user_profile(db, current_user.id, onboarding_data)
-        return user
+        user = UserService.update_user_profile(db, current_user, onboarding_data)
+        return _model_response(UserService.to_response(user))
     except Exception as e:
         logger.error(f"Error updating user profile: {e}")
         raise HTTPException(status_code=500, detail="Error updating profile")
@@ -142,37 +210,61 @@ async def send_message(
     Main chat endpoint - this does all the heavy lifting
     Handles typing indicators, LLM calls, and memory extraction
     """
-    try:
-        # Show "Disha is typing..." indicator
-        TypingService.update_typing_status(db, current_user.id, True)
-        
-        # Process the actual message through LLM
-        user_msg, assistant_msg = await ChatService.process_message(
-            db=db,
-            user=current_user,
-            message_content=request.message
-        )
-        
-        # Clear typing indicator
-        TypingService.update_typing_status(db, current_user.id, False)
-        
-        return ChatResponse(
-            user_message=MessageResponse.model_validate(user_msg),
-            assistant_message=MessageResponse.model_validate(assistant_msg),
-            context_used={
-                "protocols": assistant_msg.message_metadata.get("protocols_used", []),
-                "memories_count": assistant_msg.message_metadata.get("memories_used", 0)
-            }
-        )
-    except Exception as e:
-        logger.error(f"Error processing message: {e}")
-        # Make sure to clear typing indicator even if something crashes
-        TypingService.update_typing_status(db, current_user.id, False)
-        raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
+    # The turn's commit expires current_user - grab the id while it's loaded
+    user_id = current_user.id
+    
+    # Typing stays on for the whole turn (refreshed, so a slow LLM call can't outlive
+    # its TTL) and is cleared even if something crashes
+    async with TypingService.typing(user_id):
+        try:
+            # Process the actual message through LLM
+            user_msg, assistant_msg = await ChatService.process_message(
+                db=db,
+                user=current_user,
+                message_content=request.message
+            )
+            
+            # Both rows were just written by us - build the response without re-validating it
+            response = ChatResponse.model_construct(
+                user_message=user_msg,
+                assistant_message=assistant_msg,
+                context_used={
+                    "protocols": assistant_msg.message_metadata.get("protocols_used", []),
+                    "memories_count": assistant_msg.message_metadata.get("memories_used", 0)
+                }
+            )
+            return _model_response(response)
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+            raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
+
+
+@app.post("/api/chat/stream")
+async def stream_message(
+    request: ChatRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Streaming version of /api/chat - Server-Sent Events, one JSON object per event
+    Events: user_message, delta (repeated, a chunk of reply text), then
+    assistant_message once the reply is saved - or error if something broke
+    """
+    # Grab the id now - the request's DB session is gone once the body starts streaming
+    user_id = current_user.id
+    
+    async def event_stream():
+        async for event in ChatService.stream_message(user_id, request.message):
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
 
 
 @app.get("/api/messages", response_model=MessageListResponse)
-async def get_messages(
+def get_messages(
     limit: int = 50,
     before_id: Optional[int] = None,
     current_user: User = Depends(get_current_user),
@@ -192,12 +284,14 @@ async def get_messages(
         if limit < 1 or limit > 100:
             raise HTTPException(status_code=400, detail="Limit must be between 1 and 100")
         
-        return MessageService.get_messages(
+        # Hot path (polled + infinite scroll) - skip response_model validation and
+        # let orjson encode the pre-shaped dicts directly
+        return ORJSONResponse(MessageService.get_messages_raw(
             db=db,
             user_id=current_user.id,
             limit=limit,
             before_id=before_id
-        )
+        ))
     except HTTPException:
         raise
     except Exception as e:
@@ -207,15 +301,13 @@ async def get_messages(
 
 # Typing indicator endpoints
 @app.post("/api/typing")
-async def update_typing(
+def update_typing(
     typing_update: TypingUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user)
 ):
     """Update typing indicator status."""
     try:
         TypingService.update_typing_status(
-            db=db,
             user_id=current_user.id,
             is_typing=typing_update.is_typing
         )
@@ -226,13 +318,12 @@ async def update_typing(
 
 
 @app.get("/api/typing", response_model=TypingStatus)
-async def get_typing_status(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+def get_typing_status(
+    current_user: User = Depends(get_current_user)
 ):
     """Get assistant typing status."""
     try:
-        status_data = TypingService.get_typing_status(db, current_user.id)
+        status_data = TypingService.get_typing_status(current_user.id)
         return TypingStatus(
             is_typing=status_data["is_typing"],
             updated_at=status_data["updated_at"] or datetime.utcnow()
@@ -244,7 +335,7 @@ async def get_typing_status(
 
 # Memory endpoints (for debugging/admin)
 @app.post("/api/memories", response_model=MemoryResponse)
-async def create_memory(
+def create_memory(
     memory_data: MemoryCreate,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -266,15 +357,13 @@ async def create_memory(
 
 
 @app.get("/api/memories", response_model=list[MemoryResponse])
-async def get_memories(
+def get_memories(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all memories for current user."""
     try:
-        from models import Memory
-        memories = db.query(Memory).filter(Memory.user_id == current_user.id).all()
-        return memories
+        return MemoryService.get_user_memories(db, current_user.id)
     except Exception as e:
         logger.error(f"Error fetching memories: {e}")
         raise HTTPException(status_code=500, detail="Error fetching memories")
@@ -282,7 +371,7 @@ async def get_memories(
 
 # Protocol endpoints (for admin)
 @app.post("/api/protocols/seed")
-async def seed_protocols(db: Session = Depends(get_db)):
+def seed_protocols(db: Session = Depends(get_db)):
     """Seed default protocols (admin endpoint)."""
     try:
         ProtocolService.seed_default_protocols(db)
@@ -293,12 +382,10 @@ async def seed_protocols(db: Session = Depends(get_db)):
 
 
 @app.get("/api/protocols", response_model=list[ProtocolResponse])
-async def get_protocols(db: Session = Depends(get_db)):
+def get_protocols(db: Session = Depends(get_db)):
     """Get all protocols."""
     try:
-        from models import Protocol
-        protocols = db.query(Protocol).filter(Protocol.is_active == True).all()
-        return protocols
+        return ProtocolService.get_active_protocols(db)
     except Exception as e:
         logger.error(f"Error fetching protocols: {e}")
         raise HTTPException(status_code=500, detail="Error fetching protocols")
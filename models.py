@@ -1,11 +1,15 @@
 """Database models."""
 # SQLAlchemy models - using SQLite for now, but should work with Postgres too
 from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Index, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
 from datetime import datetime
 
+# Plain JSON on SQLite, JSONB on Postgres - stored pre-parsed (no reparse on every read)
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 
 class User(Base):
     """User model - stores basic profile + health info"""
@@ -22,9 +26,9 @@ class User(Base):
     gender = Column(String(20))
     weight = Column(Integer)  # in kg
     height = Column(Integer)  # in cm
-    medical_conditions = Column(JSON)  # List of conditions
-    medications = Column(JSON)  # List of medications
-    allergies = Column(JSON)  # List of allergies
+    medical_conditions = Column(JSONType)  # List of conditions
+    medications = Column(JSONType)  # List of medications
+    allergies = Column(JSONType)  # List of allergies
     onboarding_completed = Column(Boolean, default=False)
     
     # Relationships
@@ -47,7 +51,7 @@ class Message(Base):
     
     # Extra stuff like which model was used, response time, etc.
     # had to rename this from 'metadata' - SQLAlchemy reserves that word :(
-    message_metadata = Column(JSON)
+    message_metadata = Column(JSONType)
     
     # Relationships
     user = relationship("User", back_populates="messages")
@@ -55,6 +59,8 @@ class Message(Base):
     # Composite index for fast user message lookups sorted by time
     __table_args__ = (
         Index('idx_user_created', 'user_id', 'created_at'),
+        # Cursor pagination filters and sorts on id, so this makes it a pure index range scan
+        Index('idx_user_id_desc', 'user_id', id.desc()),
     )
 
 
@@ -82,6 +88,10 @@ class Memory(Base):
     # Indexes
     __table_args__ = (
         Index('idx_user_category', 'user_id', 'category'),
+        # One row per fact - lets memory extraction upsert instead of SELECT-then-write
+        Index('idx_user_category_key', 'user_id', 'category', 'key', unique=True),
+        # Covers "this user's memories, most important first"
+        Index('idx_user_importance', 'user_id', 'importance'),
     )
 
 
@@ -96,8 +106,8 @@ class Protocol(Base):
     category = Column(String(100), index=True)  # e.g., 'symptom', 'policy', 'emergency'
     
     # Matching
-    keywords = Column(JSON, nullable=False)  # List of keywords for matching
-    trigger_phrases = Column(JSON)  # Specific phrases that trigger this protocol
+    keywords = Column(JSONType, nullable=False)  # List of keywords for matching
+    trigger_phrases = Column(JSONType)  # Specific phrases that trigger this protocol
     
     # Content
     description = Column(Text)
@@ -105,7 +115,7 @@ class Protocol(Base):
     
     # Priority system - emergency protocols should fire before general ones
     priority = Column(Integer, default=1)  # higher number = higher priority
-    requires_conditions = Column(JSON)  # conditions to check before using protocol
+    requires_conditions = Column(JSONType)  # conditions to check before using protocol
     
     # Metadata
     is_active = Column(Boolean, default=True)
@@ -117,18 +127,3 @@ class Protocol(Base):
         Index('idx_category_active', 'category', 'is_active'),
     )
 
-
-class TypingIndicator(Base):
-    """Typing indicators - for that WhatsApp feel
-    Shows 'Disha is typing...' while LLM is thinking"""
-    __tablename__ = "typing_indicators"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    is_typing = Column(Boolean, default=False)
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
-    
-    # Index
-    __table_args__ = (
-        Index('idx_user_typing', 'user_id', 'is_typing'),
-    )
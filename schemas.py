@@ -1,6 +1,6 @@
 """Pydantic schemas for API validation."""
 # These handle all request/response validation - Pydantic is awesome for this
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, validator
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 
@@ -33,8 +33,8 @@ class UserResponse(UserBase):
     onboarding_completed: bool
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    # Response-only and built from trusted rows - frozen so instances can be shared safely
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
 
 # Message schemas
@@ -57,13 +57,12 @@ class MessageResponse(BaseModel):
     created_at: datetime
     message_metadata: Optional[Dict[str, Any]] = None
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
 
 class MessageListResponse(BaseModel):
     messages: List[MessageResponse]
-    total: int
+    total: Optional[int] = None  # only set on the first page
     has_more: bool
     next_cursor: Optional[int] = None
 
@@ -101,8 +100,7 @@ class MemoryResponse(BaseModel):
     importance: int
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
 
 # Protocol schemas
@@ -125,8 +123,7 @@ class ProtocolResponse(BaseModel):
     description: Optional[str]
     priority: int
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
 
 # Typing indicator schemas
@@ -0,0 +1,162 @@
+"""Semantic response cache for LLM calls."""
+# People ask the same health questions over and over ("I have a fever", "my head hurts")
+# If a user asks something that means the same thing as a question we answered for them
+# recently, we can hand back the earlier answer and skip the LLM call (latency + cost win)
+from typing import List, Optional, Tuple
+from collections import OrderedDict
+import functools
+import hashlib
+import logging
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_REDIS_KEY_PREFIX = "disha:semantic_cache:"
+_TIMESTAMP = struct.Struct("<d")
+
+
+@functools.lru_cache(maxsize=None)
+def _get_embedder(model_name: str):
+    """Load the sentence embedding model once - takes a couple of seconds"""
+    # Optional dependency - only needed when SEMANTIC_CACHE_ENABLED is on
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
+class SemanticCache:
+    """In-memory nearest-neighbour cache of (question embedding -> response)
+    
+    Entries are bucketed by a context key (the caller's scope - one user and their
+    profile - plus the static system prompt), so replies are never shared across
+    users. The conversation history isn't part of the key, otherwise a repeated
+    question could never hit (the first answer is in the history by then).
+    Instead entries expire after ttl_seconds, which keeps answers from drifting
+    too far from the user's current memories.
+    """
+    
+    def __init__(
+        self,
+        model_name: str,
+        threshold: float = 0.9,
+        max_contexts: int = 1000,
+        max_entries_per_context: int = 50,
+        ttl_seconds: int = 60 * 60,
+        redis_url: Optional[str] = None
+    ):
+        import numpy as np
+        self._np = np
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_contexts = max_contexts
+        self.max_entries_per_context = max_entries_per_context
+        self.ttl_seconds = ttl_seconds
+        _get_embedder(model_name)  # load up front so a missing dependency fails fast
+        
+        # context key -> (normalized embeddings matrix, responses, stored-at timestamps)
+        self._buckets: "OrderedDict[bytes, Tuple[object, List[str], List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        self._redis = None
+        if redis_url:
+            import redis
+            self._redis = redis.Redis.from_url(redis_url)
+    
+    @staticmethod
+    def context_key(scope: str, static_prompt: str) -> bytes:
+        """Hash the caller's scope with the static prompt - a prompt change starts fresh"""
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(scope.encode())
+        hasher.update(b"\0")
+        hasher.update(static_prompt.encode())
+        return hasher.digest()
+    
+    def embed(self, text: str):
+        """Normalized embedding (so inner product == cosine similarity)
+        Embed the question once and pass the vector to both lookup() and store()"""
+        embedding = _get_embedder(self.model_name).encode(text, normalize_embeddings=True)
+        return self._np.asarray(embedding, dtype=self._np.float32)
+    
+    def _get_bucket(self, key: bytes):
+        """Bucket from memory, falling back to Redis after a restart"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                self._buckets.move_to_end(key)
+                return bucket
+        
+        if self._redis is None:
+            return None
+        
+        try:
+            raw = self._redis.lrange(_REDIS_KEY_PREFIX + key.hex(), 0, -1)
+        except Exception as e:
+            logger.warning(f"Semantic cache Redis read failed: {e}")
+            return None
+        if not raw:
+            return None
+        
+        # Each entry is the stored-at timestamp, the float32 embedding bytes, a NUL byte,
+        # then the UTF-8 response
+        dim = _get_embedder(self.model_name).get_sentence_embedding_dimension()
+        offset = _TIMESTAMP.size
+        vectors, responses, stored_at = [], [], []
+        for item in raw[-self.max_entries_per_context:]:
+            stored_at.append(_TIMESTAMP.unpack_from(item)[0])
+            vectors.append(self._np.frombuffer(item[offset:offset + dim * 4], dtype=self._np.float32))
+            responses.append(item[offset + dim * 4 + 1:].decode())
+        bucket = (self._np.vstack(vectors), responses, stored_at)
+        with self._lock:
+            self._put_bucket(key, bucket)
+        return bucket
+    
+    def _put_bucket(self, key: bytes, bucket):
+        # caller holds the lock
+        self._buckets[key] = bucket
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_contexts:
+            self._buckets.popitem(last=False)
+    
+    def lookup(self, key: bytes, vector) -> Optional[str]:
+        """Cached response for a question that means the same thing, if any"""
+        bucket = self._get_bucket(key)
+        if bucket is None:
+            return None
+        
+        matrix, responses, stored_at = bucket
+        scores = matrix @ vector
+        # Expired entries can't match - they're dropped for real on the next store()
+        expired = self._np.asarray(stored_at) < time.time() - self.ttl_seconds
+        scores[expired] = -1.0
+        best = int(scores.argmax())
+        if scores[best] >= self.threshold:
+            return responses[best]
+        return None
+    
+    def store(self, key: bytes, vector, response: str):
+        """Remember a fresh LLM response for this context"""
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                matrix, responses, stored_at = vector[None, :], [response], [now]
+            else:
+                # Drop expired entries while we're here, then cap the bucket
+                keep = [i for i, ts in enumerate(bucket[2]) if ts >= now - self.ttl_seconds]
+                cap = self.max_entries_per_context
+                matrix = self._np.vstack([bucket[0][keep], vector])[-cap:]
+                responses = ([bucket[1][i] for i in keep] + [response])[-cap:]
+                stored_at = ([bucket[2][i] for i in keep] + [now])[-cap:]
+            self._put_bucket(key, (matrix, responses, stored_at))
+        
+        if self._redis is not None:
+            redis_key = _REDIS_KEY_PREFIX + key.hex()
+            try:
+                pipe = self._redis.pipeline()
+                pipe.rpush(redis_key, _TIMESTAMP.pack(now) + vector.tobytes() + b"\0" + response.encode())
+                pipe.ltrim(redis_key, -self.max_entries_per_context, -1)
+                pipe.expire(redis_key, self.ttl_seconds)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Semantic cache Redis write failed: {e}")
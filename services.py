@@ -1,19 +1,64 @@
 """Service layer for business logic."""
 # Keeping all business logic separate from API routes - makes testing easier
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, and_
-from typing import List, Optional, Dict, Any, Tuple
-from models import User, Message, Memory, Protocol, TypingIndicator
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy import Text, cast, desc, and_, func, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from cachetools import LRUCache, TTLCache
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
+from database import SessionLocal
+from models import User, Message, Memory, Protocol
 from schemas import (
     UserCreate, MessageCreate, MemoryCreate, OnboardingData,
-    MessageListResponse, MessageResponse
+    MessageResponse, MemoryResponse, ProtocolResponse, UserResponse
 )
-from llm_service import llm_service
+from llm_service import get_llm_service
+from config import settings
+import ahocorasick
+import asyncio
+import contextlib
+import orjson
+import functools
 import logging
+import re
+import threading
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# username -> detached User snapshot, so known users don't cost a SELECT per request
+# TTLCache isn't thread-safe and the sync endpoints run in FastAPI's threadpool
+_user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+_user_cache_lock = threading.Lock()
+
+# username -> (last_active_at, profile dict) - the prompt needs the profile every chat
+# turn and it only changes when the user row does (which bumps last_active_at)
+_profile_cache: LRUCache = LRUCache(maxsize=10_000)
+_profile_cache_lock = threading.Lock()
+
+# Active protocols for GET /api/protocols - they only change when seeded
+_active_protocols_cache: Optional[List[ProtocolResponse]] = None
+
+# Fire-and-forget tasks (memory extraction) - the event loop only keeps weak
+# references, so hold them here until they finish
+_background_tasks: set = set()
+
+# Dialects with INSERT ... ON CONFLICT - lets the DB dedupe instead of SELECT-then-INSERT
+_CONFLICT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# Bumped whenever protocols change - the keyword matcher is rebuilt when it's stale
+_protocol_version = 0
+# (version, keyword automaton, [(trigger phrase regex or None, protocol dict)] in priority order)
+_protocol_matcher: Optional[Tuple] = None
+
+# user_id -> (is_typing, updated_at) - short TTL since it's only meaningful mid-reply
+# Used when Redis isn't configured (or is down)
+# A turn can outlast the TTL (slow LLM call), so typing() re-sets it every few seconds
+_TYPING_TTL_SECONDS = 10
+_TYPING_REFRESH_SECONDS = 4
+_TYPING_KEY_PREFIX = "disha:typing:"
+_typing_state: TTLCache = TTLCache(maxsize=10_000, ttl=_TYPING_TTL_SECONDS)
+_typing_lock = threading.Lock()
+
 
 class UserService:
     """Service for user operations."""
@@ -32,30 +77,78 @@ class UserService:
         return user
     
     @staticmethod
-    def update_user_profile(db: Session, user_id: int, data: OnboardingData) -> User:
-        """Update user profile after onboarding."""
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            raise ValueError("User not found")
-        
-        user.age = data.age
-        user.gender = data.gender
-        user.weight = data.weight
-        user.height = data.height
-        user.medical_conditions = data.medical_conditions or []
-        user.medications = data.medications or []
-        user.allergies = data.allergies or []
-        user.onboarding_completed = True
+    def get_cached_user(db: Session, username: str) -> User:
+        """get_or_create_user with a short-lived in-process cache in front of it"""
+        with _user_cache_lock:
+            snapshot = _user_cache.get(username)
         
+        if snapshot is None:
+            user = UserService.get_or_create_user(db, username)
+            
+            # Detached copy of the loaded columns - the original belongs to this session
+            snapshot = User(**{
+                attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs
+            })
+            make_transient_to_detached(snapshot)
+            with _user_cache_lock:
+                _user_cache[username] = snapshot
+            return user
+        
+        # Attach a copy to this session without going back to the DB
+        return db.merge(snapshot, load=False)
+    
+    @staticmethod
+    def to_response(user: User) -> UserResponse:
+        """UserResponse from a loaded row - skips Pydantic validation, the columns already match"""
+        return UserResponse.model_construct(
+            id=user.id,
+            username=user.username,
+            full_name=user.full_name,
+            age=user.age,
+            gender=user.gender,
+            onboarding_completed=user.onboarding_completed,
+            created_at=user.created_at
+        )
+    
+    @staticmethod
+    def invalidate_cached_user(username: str):
+        """Drop a cached user after its row changes"""
+        with _user_cache_lock:
+            _user_cache.pop(username, None)
+        with _profile_cache_lock:
+            _profile_cache.pop(username, None)
+    
+    @staticmethod
+    def update_user_profile(db: Session, user: User, data: OnboardingData) -> User:
+        """Update user profile after onboarding.
+        Takes the caller's already-loaded user, so this is a single UPDATE"""
+        # Only what the client actually sent - unset fields keep their current value
+        values = data.model_dump(exclude_unset=True)
+        for field in ("medical_conditions", "medications", "allergies"):
+            if field in values and values[field] is None:
+                values[field] = []
+        
+        db.execute(
+            update(User)
+            .where(User.id == user.id)
+            .values(**values, onboarding_completed=True)
+        )
+        user_id, username = user.id, user.username  # commit expires the instance
         db.commit()
-        db.refresh(user)
+        UserService.invalidate_cached_user(username)
         logger.info(f"Updated profile for user {user_id}")
         return user
     
     @staticmethod
     def get_user_profile(user: User) -> Dict[str, Any]:
-        """Get user profile as dictionary."""
-        return {
+        """Get user profile as dictionary.
+        Cached per user until the row changes - treat the result as read-only"""
+        with _profile_cache_lock:
+            cached = _profile_cache.get(user.username)
+        if cached is not None and cached[0] == user.last_active_at:
+            return cached[1]
+        
+        profile = {
             "full_name": user.full_name,
             "age": user.age,
             "gender": user.gender,
@@ -65,11 +158,27 @@ class UserService:
             "medications": user.medications or [],
             "allergies": user.allergies or []
         }
+        with _profile_cache_lock:
+            _profile_cache[user.username] = (user.last_active_at, profile)
+        return profile
 
 
 class MessageService:
     """Service for message operations."""
     
+    @staticmethod
+    def to_response(message: Message) -> MessageResponse:
+        """MessageResponse straight from a row we just wrote - skips Pydantic validation
+        since the column types already match the schema"""
+        return MessageResponse.model_construct(
+            id=message.id,
+            user_id=message.user_id,
+            role=message.role,
+            content=message.content,
+            created_at=message.created_at,
+            message_metadata=message.message_metadata
+        )
+    
     @staticmethod
     def create_message(
         db: Session,
@@ -77,12 +186,14 @@ class MessageService:
         role: str,
         content: str,
         token_count: int = 0,
-        message_metadata: Optional[Dict] = None
+        message_metadata: Optional[Dict] = None,
+        autocommit: bool = True
     ) -> Message:
-        """Save a message to DB - handles both user and assistant messages"""
+        """Save a message to DB - handles both user and assistant messages
+        autocommit=False just flushes (so the id is assigned) and leaves the commit to the caller"""
         # Auto-count tokens if not provided
         if token_count == 0:
-            token_count = llm_service.count_tokens(content)
+            token_count = get_llm_service().count_tokens(content)
         
         message = Message(
             user_id=user_id,
@@ -92,67 +203,91 @@ class MessageService:
             message_metadata=message_metadata or {}
         )
         db.add(message)
+        if not autocommit:
+            db.flush()
+            return message
         db.commit()
         db.refresh(message)
         return message
     
     @staticmethod
-    def get_messages(
+    def get_messages_raw(
         db: Session,
         user_id: int,
         limit: int = 50,
         before_id: Optional[int] = None
-    ) -> MessageListResponse:
+    ) -> Dict[str, Any]:
         """
         Cursor-based pagination - way better than offset/limit for infinite scroll
         Fetching newest first, then frontend reverses them for display
+        Returns plain dicts shaped like MessageListResponse so the API can hand
+        them straight to orjson - no ORM objects, no Pydantic per row
+        message_metadata is left as the stored JSON text (wrapped in orjson.Fragment)
+        instead of being parsed into a dict just to be re-encoded
         """
         query = db.query(Message).filter(Message.user_id == user_id)
         
         if before_id:
             query = query.filter(Message.id < before_id)
         
+        metadata_column = cast(Message.message_metadata, Text).label("message_metadata")
+        
         # Fetch one extra message to check if there's more (clever pagination trick)
-        messages = query.order_by(desc(Message.created_at)).limit(limit + 1).all()
+        rows = (
+            query.with_entities(
+                Message.id, Message.user_id, Message.role, Message.content,
+                Message.created_at, metadata_column
+            )
+            .order_by(desc(Message.id))  # same column as the cursor - ids grow with created_at
+            .limit(limit + 1)
+            .all()
+        )
         
-        has_more = len(messages) > limit
+        has_more = len(rows) > limit
         if has_more:
-            messages = messages[:limit]
+            rows = rows[:limit]
         
-        # Get total count
-        total = db.query(Message).filter(Message.user_id == user_id).count()
+        # Total only on the first page - infinite scroll relies on has_more, so
+        # re-counting the user's whole history on every older page is wasted work
+        total = None
+        if before_id is None:
+            total = db.query(Message).filter(Message.user_id == user_id).count()
         
         # Next cursor is the ID of the oldest message in this batch
-        next_cursor = messages[-1].id if messages and has_more else None
+        next_cursor = rows[-1].id if rows and has_more else None
         
-        return MessageListResponse(
-            messages=[MessageResponse.model_validate(msg) for msg in messages],
-            total=total,
-            has_more=has_more,
-            next_cursor=next_cursor
-        )
+        messages = [row._asdict() for row in rows]
+        for message in messages:
+            if message["message_metadata"] is not None:
+                message["message_metadata"] = orjson.Fragment(message["message_metadata"])
+        
+        return {
+            "messages": messages,
+            "total": total,
+            "has_more": has_more,
+            "next_cursor": next_cursor
+        }
     
     @staticmethod
     def get_recent_messages(
         db: Session,
         user_id: int,
         limit: int = 20
-    ) -> List[Dict[str, str]]:
+    ) -> List[Dict[str, Any]]:
         """Get recent messages formatted for LLM context."""
-        messages = (
-            db.query(Message)
-            .filter(Message.user_id == user_id)
-            .order_by(desc(Message.created_at))
+        # Only the columns the LLM context needs - skips ORM objects and the metadata JSON
+        rows = db.execute(
+            select(Message.role, Message.content, Message.token_count)
+            .where(Message.user_id == user_id)
+            .order_by(desc(Message.id))  # rides the (user_id, id DESC) index
             .limit(limit)
-            .all()
-        )
+        ).all()
         
         # Reverse to chronological order
-        messages = list(reversed(messages))
-        
+        # token_count was stored on insert - lets truncate_context skip re-tokenizing history
         return [
-            {"role": msg.role, "content": msg.content}
-            for msg in messages
+            {"role": role, "content": content, "token_count": token_count}
+            for role, content, token_count in reversed(rows)
         ]
 
 
@@ -186,7 +321,7 @@ class MemoryService:
             # Update existing memory instead of creating duplicate
             existing.value = value
             existing.importance = importance
-            existing.last_accessed_at = datetime.utcnow()
+            existing.last_accessed_at = func.now()  # DB stamps it - same clock as the server defaults
             db.commit()
             db.refresh(existing)
             return existing
@@ -203,6 +338,26 @@ class MemoryService:
         db.refresh(memory)
         return memory
     
+    @staticmethod
+    def get_user_memories(
+        db: Session,
+        user_id: int,
+        limit: int = 100
+    ) -> List[MemoryResponse]:
+        """A user's memories (admin/debug view), most important first
+        Only selects the columns the response needs - no full ORM objects"""
+        rows = (
+            db.query(
+                Memory.id, Memory.category, Memory.key,
+                Memory.value, Memory.importance, Memory.created_at
+            )
+            .filter(Memory.user_id == user_id)
+            .order_by(desc(Memory.importance))
+            .limit(limit)
+            .all()
+        )
+        return [MemoryResponse.model_construct(**row._asdict()) for row in rows]
+    
     @staticmethod
     def get_relevant_memories(
         db: Session,
@@ -210,8 +365,10 @@ class MemoryService:
         limit: int = 10
     ) -> List[Dict[str, Any]]:
         """Get most relevant memories for context."""
+        # Just the columns the prompt needs - no ORM objects to dirty-track
         memories = (
             db.query(Memory)
+            .with_entities(Memory.id, Memory.category, Memory.key, Memory.value, Memory.importance)
             .filter(Memory.user_id == user_id)
             .order_by(
                 desc(Memory.importance),
@@ -221,13 +378,11 @@ class MemoryService:
             .all()
         )
         
-        # Update last_accessed_at
-        for memory in memories:
-            memory.last_accessed_at = datetime.utcnow()
-        db.commit()
-        
+        # last_accessed_at isn't stamped here - see mark_memories_used, the chat turn
+        # does that in the same transaction as its messages
         return [
             {
+                "id": m.id,
                 "category": m.category,
                 "key": m.key,
                 "value": m.value,
@@ -236,33 +391,157 @@ class MemoryService:
             for m in memories
         ]
     
+    @staticmethod
+    def mark_memories_used(db: Session, memories: List[Dict[str, Any]]):
+        """Bump last_accessed_at for memories that went into a prompt
+        One UPDATE for the batch, and no commit - it rides on the caller's"""
+        if not memories:
+            return
+        db.execute(
+            update(Memory)
+            .where(Memory.id.in_([m["id"] for m in memories]))
+            .values(last_accessed_at=func.now())
+            .execution_options(synchronize_session=False)
+        )
+    
+    @staticmethod
+    def upsert_memories(db: Session, user_id: int, memories: List[Dict[str, Any]]):
+        """Store a batch of extracted memories in one statement + one commit
+        Same dedup rule as create_memory - an existing category+key gets the new value"""
+        # Last one wins if the LLM repeats a key - Postgres rejects touching a row twice in one upsert
+        rows = {}
+        for mem_data in memories:
+            # LLM output - skip anything that isn't a proper memory rather than fail the batch
+            if not isinstance(mem_data, dict) or not isinstance(mem_data.get("value"), str):
+                continue
+            category = mem_data.get("category", "general")
+            key = mem_data.get("key", "info")
+            rows[(category, key)] = {
+                "user_id": user_id,
+                "category": category,
+                "key": key,
+                "value": mem_data.get("value", ""),
+                "importance": mem_data.get("importance", 1)
+            }
+        if not rows:
+            return
+        
+        conflict_insert = _CONFLICT_INSERTS.get(db.get_bind().dialect.name)
+        if conflict_insert is None:
+            for row in rows.values():
+                MemoryService.create_memory(db=db, **row)
+            return
+        
+        stmt = conflict_insert(Memory).values(list(rows.values()))
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["user_id", "category", "key"],
+            set_={
+                "value": stmt.excluded.value,
+                "importance": stmt.excluded.importance,
+                "last_accessed_at": func.now()
+            }
+        ))
+        db.commit()
+    
     @staticmethod
     async def extract_and_store_memories(
-        db: Session,
         user_id: int,
         conversation: str
     ):
         """Pull out important health info from conversation and save it
-        LLM does the heavy lifting here - extracts key facts automatically"""
+        LLM does the heavy lifting here - extracts key facts automatically
+        Runs as a background task after the response is sent, so it opens its own
+        DB session instead of borrowing the (already closed) request one"""
         try:
-            memories = await llm_service.extract_memories(conversation)
-            for mem_data in memories:
-                MemoryService.create_memory(
-                    db=db,
-                    user_id=user_id,
-                    category=mem_data.get("category", "general"),
-                    key=mem_data.get("key", "info"),
-                    value=mem_data.get("value", ""),
-                    importance=mem_data.get("importance", 1)
-                )
-            logger.info(f"Extracted {len(memories)} memories for user {user_id}")
+            memories = await get_llm_service().extract_memories(conversation)
+            if not memories:
+                return
         except Exception as e:
             logger.error(f"Error extracting memories: {e}")
+            return
+        
+        try:
+            await asyncio.to_thread(MemoryService._store_extracted_memories, user_id, memories)
+            logger.info(f"Extracted {len(memories)} memories for user {user_id}")
+        except Exception as e:
+            logger.error(f"Error storing memories: {e}")
+    
+    @staticmethod
+    def _store_extracted_memories(user_id: int, memories: List[Dict[str, Any]]):
+        """Blocking half of extract_and_store_memories - runs in a worker thread"""
+        db = SessionLocal()
+        try:
+            MemoryService.upsert_memories(db, user_id, memories)
+        finally:
+            db.close()
 
 
 class ProtocolService:
     """Service for protocol operations."""
     
+    @staticmethod
+    def get_active_protocols(db: Session) -> List[ProtocolResponse]:
+        """Active protocols for listing - cached until the next seed"""
+        global _active_protocols_cache
+        if _active_protocols_cache is None:
+            protocols = db.query(Protocol).filter(Protocol.is_active == True).all()
+            _active_protocols_cache = [ProtocolResponse.model_validate(p) for p in protocols]
+        return _active_protocols_cache
+    
+    @staticmethod
+    def invalidate_protocols():
+        """Call after any protocol change - cached lists/matchers are rebuilt on next read"""
+        global _active_protocols_cache, _protocol_version
+        _active_protocols_cache = None
+        _protocol_version += 1
+    
+    @staticmethod
+    def _get_protocol_matcher(db: Session):
+        """Keyword automaton over all active protocols, rebuilt only when protocols change"""
+        global _protocol_matcher
+        if _protocol_matcher is not None and _protocol_matcher[0] == _protocol_version:
+            return _protocol_matcher
+        
+        # Plain row tuples - this is read-only, no need for ORM instances
+        protocols = db.execute(
+            select(
+                Protocol.name, Protocol.category, Protocol.keywords, Protocol.trigger_phrases,
+                Protocol.response_template, Protocol.priority
+            )
+            .where(Protocol.is_active == True)
+            .order_by(desc(Protocol.priority))
+        ).all()
+        
+        # Keywords/trigger phrases are lowercased here once, not on every chat turn
+        entries = []
+        keyword_hits: Dict[str, List[int]] = {}
+        for i, protocol in enumerate(protocols):
+            for keyword in protocol.keywords or []:
+                keyword_hits.setdefault(keyword.lower(), []).append(i)
+            # All of a protocol's trigger phrases as one compiled alternation - a single
+            # C-level scan instead of a Python `in` per phrase
+            trigger_phrases = [phrase.lower() for phrase in protocol.trigger_phrases or []]
+            trigger_pattern = re.compile("|".join(map(re.escape, trigger_phrases))) if trigger_phrases else None
+            entries.append((
+                trigger_pattern,
+                {
+                    "name": protocol.name,
+                    "category": protocol.category,
+                    "response_template": protocol.response_template,
+                    "priority": protocol.priority
+                }
+            ))
+        
+        automaton = None
+        if keyword_hits:
+            automaton = ahocorasick.Automaton()
+            for keyword, protocol_ids in keyword_hits.items():
+                automaton.add_word(keyword, protocol_ids)
+            automaton.make_automaton()
+        
+        _protocol_matcher = (_protocol_version, automaton, entries)
+        return _protocol_matcher
+    
     @staticmethod
     def match_protocols(
         db: Session,
@@ -270,40 +549,31 @@ class ProtocolService:
         user_profile: Dict[str, Any]
     ) -> List[Dict[str, Any]]:
         """Match relevant protocols based on user message."""
-        # Get all active protocols
-        protocols = (
-            db.query(Protocol)
-            .filter(Protocol.is_active == True)
-            .order_by(desc(Protocol.priority))
-            .all()
-        )
+        _, automaton, entries = ProtocolService._get_protocol_matcher(db)
+        if automaton is None:
+            return []
         
-        matched = []
+        # One pass over the message finds every keyword of every protocol
         user_message_lower = user_message.lower()
+        hit_ids = set()
+        for _, protocol_ids in automaton.iter(user_message_lower):
+            hit_ids.update(protocol_ids)
         
-        for protocol in protocols:
-            # Check keywords
-            keywords = protocol.keywords or []
-            if any(keyword.lower() in user_message_lower for keyword in keywords):
-                # Check trigger phrases
-                trigger_phrases = protocol.trigger_phrases or []
-                if trigger_phrases:
-                    if any(phrase.lower() in user_message_lower for phrase in trigger_phrases):
-                        matched.append({
-                            "name": protocol.name,
-                            "category": protocol.category,
-                            "response_template": protocol.response_template,
-                            "priority": protocol.priority
-                        })
-                else:
-                    matched.append({
-                        "name": protocol.name,
-                        "category": protocol.category,
-                        "response_template": protocol.response_template,
-                        "priority": protocol.priority
-                    })
-        
-        return matched[:3]  # Return top 3 matches
+        matched = []
+        for i in sorted(hit_ids):  # entries are already in priority order
+            trigger_pattern, protocol = entries[i]
+            # Emergency protocols sort first - if one matched, the prompt should focus
+            # on it rather than on lower-priority advice
+            if matched and matched[-1]["category"] == "emergency" and protocol["category"] != "emergency":
+                break
+            # Check trigger phrases
+            if trigger_pattern is not None and not trigger_pattern.search(user_message_lower):
+                continue
+            matched.append(dict(protocol))
+            if len(matched) == 3:  # top 3 is all the prompt uses
+                break
+        
+        return matched
     
     @staticmethod
     def seed_default_protocols(db: Session):
@@ -383,18 +653,31 @@ class ProtocolService:
             }
         ]
         
-        # Insert protocols if they don't exist already
-        for protocol_data in default_protocols:
-            existing = db.query(Protocol).filter(
-                Protocol.name == protocol_data["name"]
-            ).first()
-            
-            if not existing:
-                protocol = Protocol(**protocol_data)
-                db.add(protocol)
+        # Insert protocols if they don't exist already - one statement, the unique
+        # name index skips the ones we have
+        conflict_insert = _CONFLICT_INSERTS.get(db.get_bind().dialect.name)
+        if conflict_insert is not None:
+            # RETURNING only yields the rows actually inserted - skipped ones don't show up
+            inserted = len(db.execute(
+                conflict_insert(Protocol)
+                .on_conflict_do_nothing(index_elements=["name"])
+                .returning(Protocol.id),
+                default_protocols
+            ).all())
+        else:
+            existing = set(db.scalars(
+                select(Protocol.name).where(Protocol.name.in_([p["name"] for p in default_protocols]))
+            ))
+            new_protocols = [Protocol(**p) for p in default_protocols if p["name"] not in existing]
+            db.add_all(new_protocols)
+            inserted = len(new_protocols)
         
         db.commit()
-        logger.info("Seeded default protocols")
+        
+        # Re-seeding an up-to-date DB changes nothing - keep the cached matcher
+        if inserted:
+            ProtocolService.invalidate_protocols()
+        logger.info(f"Seeded default protocols ({inserted} new)")
         # TODO: might want to add more protocols for chronic conditions
 
 
@@ -402,23 +685,14 @@ class ChatService:
     """Main service for chat operations."""
     
     @staticmethod
-    async def process_message(
+    def _prepare_turn(
         db: Session,
         user: User,
         message_content: str
-    ) -> Tuple[Message, Message]:
-        """
-        Process user message and generate AI response.
-        Returns: (user_message, assistant_message)
-        """
-        # Create user message
-        user_message = MessageService.create_message(
-            db=db,
-            user_id=user.id,
-            role="user",
-            content=message_content
-        )
-        
+    ) -> Dict[str, Any]:
+        """Gather everything the LLM needs for this turn
+        The user's message isn't saved here - callers store it (so its token count
+        can be batched with the reply's), it's just appended to the history"""
         # Check if onboarding needed
         is_onboarding = not user.onboarding_completed
         
@@ -432,75 +706,318 @@ class ChatService:
         protocols = ProtocolService.match_protocols(db, message_content, user_profile)
         
         # Create system prompt
-        system_prompt = llm_service.create_system_prompt(
+        system_prompt = get_llm_service().create_system_prompt(
             user_profile=user_profile,
             memories=memories,
             protocols=protocols,
             is_onboarding=is_onboarding
         )
         
-        # Get recent message history
-        message_history = MessageService.get_recent_messages(db, user.id, limit=20)
+        # Get recent message history, plus the message we're replying to
+        message_history = MessageService.get_recent_messages(db, user.id, limit=19)
+        message_history.append({"role": "user", "content": message_content})
         
-        # Generate response
-        response_content, metadata = await llm_service.generate_response(
-            messages=message_history,
-            system_prompt=system_prompt
-        )
+        # Semantic cache bucket - one per user and profile, so an edited profile starts
+        # fresh. Onboarding replies are about personal details, never cache those
+        cache_scope = None
+        if not is_onboarding:
+            cache_scope = f"{user.id}:" + orjson.dumps(user_profile, option=orjson.OPT_SORT_KEYS).decode()
         
+        return {
+            "system_prompt": system_prompt,
+            "cache_scope": cache_scope,
+            "message_history": message_history,
+            "protocols": protocols,
+            "memories": memories,
+            "is_onboarding": is_onboarding
+        }
+    
+    @staticmethod
+    def _save_reply(
+        db: Session,
+        user_id: int,
+        response_content: str,
+        metadata: Dict[str, Any],
+        context: Dict[str, Any],
+        token_count: int = 0,
+        autocommit: bool = True
+    ) -> Message:
+        """Store the assistant's reply along with what context went into it"""
         # Add context info to metadata
-        metadata["protocols_used"] = [p["name"] for p in protocols]
-        metadata["memories_used"] = len(memories)
-        metadata["is_onboarding"] = is_onboarding
+        metadata["protocols_used"] = [p["name"] for p in context["protocols"]]
+        metadata["memories_used"] = len(context["memories"])
+        metadata["is_onboarding"] = context["is_onboarding"]
+        
+        # Saved together with the reply, so the turn doesn't commit just for this
+        MemoryService.mark_memories_used(db, context["memories"])
         
         # Create assistant message
-        assistant_message = MessageService.create_message(
+        return MessageService.create_message(
             db=db,
-            user_id=user.id,
+            user_id=user_id,
             role="assistant",
             content=response_content,
-            message_metadata=metadata
+            token_count=token_count,
+            message_metadata=metadata,
+            autocommit=autocommit
         )
-        
-        # Extract and store memories (async, don't wait)
-        if len(message_history) % 5 == 0:  # Every 5 messages
+    
+    @staticmethod
+    def _maybe_extract_memories(
+        user_id: int,
+        message_content: str,
+        response_content: str,
+        context: Dict[str, Any]
+    ):
+        """Extract and store memories every 5 messages
+        Fire-and-forget - the reply shouldn't wait on a second LLM call"""
+        if len(context["message_history"]) % 5 == 0:
             conversation = f"User: {message_content}\nAssistant: {response_content}"
-            await MemoryService.extract_and_store_memories(
-                db, user.id, conversation
+            task = asyncio.create_task(
+                MemoryService.extract_and_store_memories(user_id, conversation)
             )
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+    
+    @staticmethod
+    async def process_message(
+        db: Session,
+        user: User,
+        message_content: str
+    ) -> Tuple[MessageResponse, MessageResponse]:
+        """
+        Process user message and generate AI response.
+        Returns: (user_message, assistant_message)
+        The DB + tokenizer work runs in worker threads (like stream_message) - only the
+        LLM call itself is awaited on the event loop
+        """
+        user_id = user.id
+        context = await asyncio.to_thread(ChatService._prepare_turn, db, user, message_content)
+        
+        # Generate response
+        response_content, metadata = await get_llm_service().generate_response(
+            messages=context["message_history"],
+            system_prompt=context["system_prompt"],
+            cache_scope=context["cache_scope"]
+        )
+        
+        messages = await asyncio.to_thread(
+            ChatService._save_turn, db, user_id, message_content, response_content, metadata, context
+        )
+        
+        ChatService._maybe_extract_memories(
+            user_id, message_content, response_content, context
+        )
+        
+        return messages
+    
+    @staticmethod
+    def _save_turn(
+        db: Session,
+        user_id: int,
+        message_content: str,
+        response_content: str,
+        metadata: Dict[str, Any],
+        context: Dict[str, Any]
+    ) -> Tuple[MessageResponse, MessageResponse]:
+        """Blocking half of finishing a turn - count, save and serialize both messages"""
+        # Count both messages in one tokenizer call (the user's is usually
+        # already in the token cache from truncate_context)
+        user_tokens, response_tokens = get_llm_service().count_tokens_batch(
+            [message_content, response_content]
+        )
+        
+        # Both messages go in one transaction - one commit (fsync) per turn, and
+        # a failed LLM call never leaves an unanswered user message behind
+        user_message = MessageService.create_message(
+            db=db,
+            user_id=user_id,
+            role="user",
+            content=message_content,
+            token_count=user_tokens,
+            autocommit=False
+        )
+        assistant_message = ChatService._save_reply(
+            db, user_id, response_content, metadata, context,
+            token_count=response_tokens, autocommit=False
+        )
+        db.commit()
         
-        return user_message, assistant_message
+        # Still in the thread - the commit expired both rows, so reading them reloads
+        return (
+            MessageService.to_response(user_message),
+            MessageService.to_response(assistant_message)
+        )
+    
+    @staticmethod
+    def _start_streamed_turn(
+        db: Session,
+        user_id: int,
+        message_content: str
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Blocking half of starting a streamed turn - gather context and save the
+        user's message (the client needs its id before the reply starts)"""
+        user = db.get(User, user_id)
+        context = ChatService._prepare_turn(db, user, message_content)
+        user_message = MessageService.create_message(
+            db=db,
+            user_id=user_id,
+            role="user",
+            content=message_content
+        )
+        return MessageService.to_response(user_message).model_dump(), context
+    
+    @staticmethod
+    def _finish_streamed_turn(
+        db: Session,
+        user_id: int,
+        response_content: str,
+        metadata: Dict[str, Any],
+        context: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Blocking half of finishing a streamed turn - count and save the reply"""
+        token_count = get_llm_service().count_tokens(response_content)
+        assistant_message = ChatService._save_reply(
+            db, user_id, response_content, metadata, context, token_count=token_count
+        )
+        return MessageService.to_response(assistant_message).model_dump()
+    
+    @staticmethod
+    async def stream_message(
+        user_id: int,
+        message_content: str
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming version of process_message - yields events as the reply comes in:
+        user_message, then a delta per chunk, then assistant_message (or error).
+        Runs on its own DB session since the request's session is closed by the
+        time a streaming response body is being sent.
+        """
+        # All the blocking DB + tokenizer work runs in worker threads so the event
+        # loop stays free for other streams while this one waits on the LLM
+        db = SessionLocal()
+        try:
+            user_message, context = await asyncio.to_thread(
+                ChatService._start_streamed_turn, db, user_id, message_content
+            )
+            yield {"type": "user_message", "message": user_message}
+            
+            metadata: Dict[str, Any] = {}
+            chunks = []
+            async for delta in get_llm_service().stream_response(
+                messages=context["message_history"],
+                system_prompt=context["system_prompt"],
+                metadata=metadata,
+                cache_scope=context["cache_scope"]
+            ):
+                chunks.append(delta)
+                yield {"type": "delta", "content": delta}
+            
+            response_content = "".join(chunks)
+            assistant_message = await asyncio.to_thread(
+                ChatService._finish_streamed_turn, db, user_id, response_content, metadata, context
+            )
+            yield {
+                "type": "assistant_message",
+                "message": assistant_message,
+                "context_used": {
+                    "protocols": metadata["protocols_used"],
+                    "memories_count": metadata["memories_used"]
+                }
+            }
+            
+            ChatService._maybe_extract_memories(
+                user_id, message_content, response_content, context
+            )
+        except Exception as e:
+            logger.error(f"Error streaming message: {e}")
+            yield {"type": "error", "detail": f"Error processing message: {str(e)}"}
+        finally:
+            await asyncio.to_thread(db.close)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_redis():
+    """Shared Redis client if REDIS_URL is set, else None"""
+    if not settings.REDIS_URL:
+        return None
+    import redis
+    # Short timeouts - a slow or unreachable Redis should drop us to the in-process
+    # fallback quickly, not hold up the chat turn
+    return redis.Redis.from_url(
+        settings.REDIS_URL,
+        socket_timeout=0.5,
+        socket_connect_timeout=0.5
+    )
 
 
 class TypingService:
     """Service for typing indicators."""
+    # Ephemeral UI state - no point writing it to the DB on every chat turn
+    # Entries expire on their own so a crashed request can't leave "typing..." stuck on
+    # With Redis configured it's one SET ... EX, and every worker sees the same state
     
     @staticmethod
-    def update_typing_status(db: Session, user_id: int, is_typing: bool):
+    def update_typing_status(user_id: int, is_typing: bool):
         """Update typing indicator status."""
-        indicator = db.query(TypingIndicator).filter(
-            TypingIndicator.user_id == user_id
-        ).first()
-        
-        if not indicator:
-            indicator = TypingIndicator(user_id=user_id, is_typing=is_typing)
-            db.add(indicator)
-        else:
-            indicator.is_typing = is_typing
-            indicator.updated_at = datetime.utcnow()
+        updated_at = datetime.utcnow()
+        
+        client = _get_redis()
+        if client is not None:
+            try:
+                client.set(
+                    f"{_TYPING_KEY_PREFIX}{user_id}",
+                    f"{int(is_typing)}|{updated_at.isoformat()}",
+                    ex=_TYPING_TTL_SECONDS
+                )
+                return
+            except Exception as e:
+                logger.warning(f"Redis typing update failed, keeping it in memory: {e}")
         
-        db.commit()
+        with _typing_lock:
+            _typing_state[user_id] = (is_typing, updated_at)
     
     @staticmethod
-    def get_typing_status(db: Session, user_id: int) -> Dict:
+    def get_typing_status(user_id: int) -> Dict:
         """Get typing status for assistant."""
-        indicator = db.query(TypingIndicator).filter(
-            TypingIndicator.user_id == user_id
-        ).first()
-        
-        if indicator:
-            return {
-                "is_typing": indicator.is_typing,
-                "updated_at": indicator.updated_at
-            }
+        client = _get_redis()
+        if client is not None:
+            try:
+                raw = client.get(f"{_TYPING_KEY_PREFIX}{user_id}")
+                if raw:
+                    is_typing, updated_at = raw.decode().split("|", 1)
+                    return {"is_typing": is_typing == "1", "updated_at": datetime.fromisoformat(updated_at)}
+            except Exception as e:
+                logger.warning(f"Redis typing lookup failed: {e}")
+        
+        with _typing_lock:
+            state = _typing_state.get(user_id)
+        
+        if state:
+            return {"is_typing": state[0], "updated_at": state[1]}
         return {"is_typing": False, "updated_at": None}
+    
+    @staticmethod
+    @contextlib.asynccontextmanager
+    async def typing(user_id: int):
+        """Show the assistant as typing for as long as the block runs
+        Keeps re-setting the flag so it doesn't expire mid-reply, clears it on the way out"""
+        await asyncio.to_thread(TypingService.update_typing_status, user_id, True)
+        stop = asyncio.Event()
+        
+        async def keep_alive():
+            while True:
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=_TYPING_REFRESH_SECONDS)
+                    return
+                except asyncio.TimeoutError:
+                    await asyncio.to_thread(TypingService.update_typing_status, user_id, True)
+        
+        task = asyncio.create_task(keep_alive())
+        try:
+            yield
+        finally:
+            # Let an in-flight refresh finish first so it can't land after the clear
+            stop.set()
+            await task
+            await asyncio.to_thread(TypingService.update_typing_status, user_id, False)
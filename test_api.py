@@ -28,6 +28,29 @@ def test_send_message(message):
     print(f"✓ Assistant: {data['assistant_message']['content']}")
     return data
 
+def test_stream_message(message):
+    """Test streaming a message over SSE."""
+    print(f"\nStreaming message: {message}")
+    response = requests.post(
+        f"{BASE_URL}/api/chat/stream?username={USERNAME}",
+        json={"message": message},
+        stream=True
+    )
+    assert response.status_code == 200
+    events = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line and line.startswith("data: "):
+            events.append(json.loads(line[len("data: "):]))
+    types = [e["type"] for e in events]
+    assert "error" not in types, events[-1]
+    assert types[0] == "user_message"
+    assert types[-1] == "assistant_message"
+    reply = "".join(e["content"] for e in events if e["type"] == "delta")
+    assert reply == events[-1]["message"]["content"]
+    print(f"✓ User: {events[0]['message']['content']}")
+    print(f"✓ Assistant ({types.count('delta')} chunks): {reply}")
+    return events
+
 def test_get_messages():
     """Test getting message history."""
     print("\nFetching message history...")
@@ -78,6 +101,9 @@ def run_tests():
         test_send_message("I have a slight headache and fever.")
         time.sleep(1)
         
+        test_stream_message("Should I take anything for the headache?")
+        time.sleep(1)
+        
         # Get message history
         test_get_messages()
         